@@ -0,0 +1,402 @@
+import glob
+import gzip
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLog:
+    """Append-only audit trail of every recommendation.
+
+    Callers only push entries into an in-memory ring buffer; a background
+    thread drains it in batches into SQLite databases or gzip-compressed
+    JSONL segments, rotating to a new segment once the current one reaches
+    `max_segment_bytes`.
+
+    SQLite segments are indexed by timestamp and protocol. JSONL segments only
+    keep a small sidecar index (time range and protocol set) used to skip whole
+    segments and to stop once older segments cannot contribute to the result;
+    the segments that remain are scanned.
+    """
+
+    BACKENDS = ("sqlite", "jsonl")
+
+    def __init__(
+        self,
+        directory: str = "audit",
+        backend: str = "sqlite",
+        capacity: int = 4096,
+        batch_size: int = 128,
+        flush_interval: float = 1.0,
+        max_segment_bytes: int = 64 * 1024 * 1024,
+        block_timeout: float = 0.05,
+    ):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown audit backend '{backend}'. Expected one of {self.BACKENDS}.")
+
+        self.directory = directory
+        self.backend = backend
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_segment_bytes = max_segment_bytes
+        self.block_timeout = block_timeout
+
+        # Ring buffer shared with the writer thread
+        self._buffer: Deque[Dict[str, Any]] = deque()
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._closed = False
+        self._flush_requested = False
+        self.dropped = 0
+        self.written = 0
+
+        self._segment_path: Optional[str] = None
+        self._segment_index: Dict[str, Any] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._writer = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._writer.start()
+
+    @classmethod
+    def from_env(cls) -> "AuditLog":
+        """Builds an AuditLog from the AUDIT_* environment variables."""
+        return cls(
+            directory=os.getenv("AUDIT_DIR", "audit"),
+            backend=os.getenv("AUDIT_BACKEND", "sqlite"),
+            capacity=int(os.getenv("AUDIT_CAPACITY", "4096")),
+            batch_size=int(os.getenv("AUDIT_BATCH_SIZE", "128")),
+            flush_interval=float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0")),
+            max_segment_bytes=int(os.getenv("AUDIT_MAX_SEGMENT_BYTES", str(64 * 1024 * 1024))),
+        )
+
+    # --- Producer side ---
+
+    def record(self, entry: Dict[str, Any], block: bool = True) -> bool:
+        """Queues an entry without touching the disk.
+
+        When the buffer is full the caller waits at most `block_timeout`
+        seconds for the writer to catch up (never, with `block=False`, as
+        needed on an event loop); after that the oldest entry is overwritten
+        and counted in `dropped`. Returns False if an entry was lost.
+        """
+        entry = dict(entry)
+        entry.setdefault("timestamp", datetime.now(timezone.utc).isoformat())
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Audit log is closed.")
+
+            lost = False
+            if len(self._buffer) >= self.capacity:
+                self._cond.notify_all()
+                if block:
+                    self._cond.wait_for(lambda: len(self._buffer) < self.capacity, timeout=self.block_timeout)
+                if len(self._buffer) >= self.capacity:
+                    self._buffer.popleft()
+                    self.dropped += 1
+                    lost = True
+
+            self._buffer.append(entry)
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify_all()
+            return not lost
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until every queued entry has been written to disk."""
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not self._buffer and not self._in_flight, timeout=timeout)
+
+    def close(self, timeout: Optional[float] = 5.0) -> None:
+        """Flushes pending entries and stops the writer thread."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "backend": self.backend,
+                "queued": len(self._buffer),
+                "written": self.written,
+                "dropped": self.dropped,
+                "segment": self._segment_path,
+            }
+
+    # --- Writer thread ---
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or self._flush_requested or len(self._buffer) >= self.batch_size,
+                    timeout=self.flush_interval,
+                )
+                batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                self._in_flight = len(batch)
+                if not self._buffer:
+                    self._flush_requested = False
+                closing = self._closed and not self._buffer
+                # Wake producers blocked on a full buffer
+                self._cond.notify_all()
+
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception:
+                    # The writer must never die; keep the entries for the next attempt
+                    logger.exception("Audit writer failed to write %d entries; retrying", len(batch))
+                    with self._cond:
+                        self._buffer.extendleft(reversed(batch))
+                        # Producers kept filling the buffer meanwhile; stay within capacity
+                        while len(self._buffer) > self.capacity:
+                            self._buffer.popleft()
+                            self.dropped += 1
+                        self._in_flight = 0
+                    time.sleep(self.flush_interval)
+                    continue
+
+            with self._cond:
+                self.written += len(batch)
+                self._in_flight = 0
+                self._cond.notify_all()
+
+            if closing:
+                break
+
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        self._rotate_if_needed()
+        if self.backend == "sqlite":
+            self._write_sqlite(batch)
+        else:
+            self._write_jsonl(batch)
+
+    def _rotate_if_needed(self) -> None:
+        if self._segment_path is not None and os.path.exists(self._segment_path):
+            size = os.path.getsize(self._segment_path)
+            # SQLite keeps recent writes in the WAL file until a checkpoint
+            wal_path = self._segment_path + "-wal"
+            if os.path.exists(wal_path):
+                size += os.path.getsize(wal_path)
+            if size < self.max_segment_bytes:
+                return
+
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+        # Segment names sort chronologically, so queries can walk them newest first
+        extension = "db" if self.backend == "sqlite" else "jsonl.gz"
+        while True:
+            stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+            self._segment_path = os.path.join(self.directory, f"audit-{stamp}.{extension}")
+            if not os.path.exists(self._segment_path):
+                break
+        self._segment_index = {"first": None, "last": None, "protocols": []}
+
+        if self.backend == "sqlite":
+            self._conn = sqlite3.connect(self._segment_path, check_same_thread=False)
+            self._conn.executescript(
+                """
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS audit_log (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TEXT NOT NULL,
+                    payload TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS audit_protocol (
+                    audit_id INTEGER NOT NULL REFERENCES audit_log(id),
+                    protocol TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_audit_timestamp ON audit_log(timestamp);
+                CREATE INDEX IF NOT EXISTS idx_audit_protocol ON audit_protocol(protocol, audit_id);
+                """
+            )
+
+    def _write_sqlite(self, batch: List[Dict[str, Any]]) -> None:
+        assert self._conn is not None
+        with self._conn:
+            for entry in batch:
+                cursor = self._conn.execute(
+                    "INSERT INTO audit_log (timestamp, payload) VALUES (?, ?)",
+                    (entry["timestamp"], json.dumps(entry, default=str)),
+                )
+                self._conn.executemany(
+                    "INSERT INTO audit_protocol (audit_id, protocol) VALUES (?, ?)",
+                    [(cursor.lastrowid, p) for p in entry.get("matched_protocols", [])],
+                )
+
+    def _write_jsonl(self, batch: List[Dict[str, Any]]) -> None:
+        assert self._segment_path is not None
+        lines = "".join(json.dumps(entry, default=str) + "\n" for entry in batch)
+        size_before = os.path.getsize(self._segment_path) if os.path.exists(self._segment_path) else 0
+        try:
+            # Each batch becomes its own gzip member; gzip readers concatenate them
+            with gzip.open(self._segment_path, "at", encoding="utf-8") as f:
+                f.write(lines)
+        except Exception:
+            # Drop the partial member so the retry does not duplicate entries
+            if os.path.exists(self._segment_path):
+                with open(self._segment_path, "r+b") as f:
+                    f.truncate(size_before)
+            raise
+
+        index = self._segment_index
+        timestamps = [entry["timestamp"] for entry in batch]
+        index["first"] = min(timestamps + ([index["first"]] if index["first"] else []))
+        index["last"] = max(timestamps + ([index["last"]] if index["last"] else []))
+        protocols = set(index["protocols"])
+        for entry in batch:
+            protocols.update(entry.get("matched_protocols", []))
+        index["protocols"] = sorted(protocols)
+
+        index_path = self._segment_path + ".idx"
+        with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(index_path + ".tmp", index_path)
+
+    # --- Query side ---
+
+    def query(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        protocol: Optional[str] = None,
+        limit: int = 100,
+    ) -> List[Dict[str, Any]]:
+        """Returns entries written to disk between `start` and `end` (inclusive),
+        optionally restricted to those that matched `protocol`, newest first."""
+        if limit < 1:
+            raise ValueError("limit must be at least 1.")
+        start_iso = self._to_iso(start)
+        end_iso = self._to_iso(end)
+        results: List[Dict[str, Any]] = []
+        segments = list(reversed(self._segments()))
+
+        for i, path in enumerate(segments):
+            if self.backend == "sqlite":
+                results.extend(self._query_sqlite(path, start_iso, end_iso, protocol, limit - len(results)))
+                if len(results) >= limit:
+                    break
+                continue
+
+            if self._jsonl_segment_may_match(path, start_iso, end_iso, protocol):
+                found = self._query_jsonl(path, start_iso, end_iso, protocol, limit)
+                results = heapq.nlargest(limit, results + found, key=lambda e: e["timestamp"])
+            if len(results) >= limit and i + 1 < len(segments):
+                # Older segments cannot displace what we kept once they end before it
+                next_index = self._jsonl_index(segments[i + 1])
+                if next_index and next_index["last"] and next_index["last"] < results[-1]["timestamp"]:
+                    break
+
+        results.sort(key=lambda e: e["timestamp"], reverse=True)
+        return results[:limit]
+
+    def _segments(self) -> List[str]:
+        extension = "db" if self.backend == "sqlite" else "jsonl.gz"
+        return sorted(glob.glob(os.path.join(self.directory, f"audit-*.{extension}")))
+
+    @staticmethod
+    def _jsonl_index(path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path + ".idx", encoding="utf-8") as f:
+                index: Dict[str, Any] = json.load(f)
+                return index
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def _jsonl_segment_may_match(
+        cls, path: str, start_iso: Optional[str], end_iso: Optional[str], protocol: Optional[str]
+    ) -> bool:
+        index = cls._jsonl_index(path)
+        if index is None:
+            # No usable index; fall back to scanning the segment
+            return True
+        if index["first"] is None:
+            return False
+        if start_iso and index["last"] < start_iso:
+            return False
+        if end_iso and index["first"] > end_iso:
+            return False
+        if protocol and protocol not in index["protocols"]:
+            return False
+        return True
+
+    @staticmethod
+    def _to_iso(value: Optional[datetime]) -> Optional[str]:
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc).isoformat()
+
+    @staticmethod
+    def _query_sqlite(
+        path: str, start_iso: Optional[str], end_iso: Optional[str], protocol: Optional[str], limit: int
+    ) -> List[Dict[str, Any]]:
+        sql = "SELECT a.payload FROM audit_log a"
+        clauses: List[str] = []
+        params: List[Any] = []
+        if protocol:
+            sql += " JOIN audit_protocol p ON p.audit_id = a.id"
+            clauses.append("p.protocol = ?")
+            params.append(protocol)
+        if start_iso:
+            clauses.append("a.timestamp >= ?")
+            params.append(start_iso)
+        if end_iso:
+            clauses.append("a.timestamp <= ?")
+            params.append(end_iso)
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY a.timestamp DESC LIMIT ?"
+        params.append(limit)
+
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            return [json.loads(row[0]) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _query_jsonl(
+        path: str, start_iso: Optional[str], end_iso: Optional[str], protocol: Optional[str], limit: int
+    ) -> List[Dict[str, Any]]:
+        def matches() -> Iterator[Dict[str, Any]]:
+            try:
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    for line in f:
+                        entry: Dict[str, Any] = json.loads(line)
+                        if start_iso and entry["timestamp"] < start_iso:
+                            continue
+                        if end_iso and entry["timestamp"] > end_iso:
+                            continue
+                        if protocol and protocol not in entry.get("matched_protocols", []):
+                            continue
+                        yield entry
+            except EOFError:
+                # The writer may be mid-append on the active segment
+                pass
+
+        # Only the newest `limit` entries of the segment are kept in memory
+        return heapq.nlargest(limit, matches(), key=lambda e: e["timestamp"])
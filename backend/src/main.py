@@ -1,9 +1,12 @@
 import os
-from typing import List, Optional
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
 import dotenv
 import uuid
+import time
+from datetime import datetime
 
-from langchain_openai import ChatOpenAI
 from langchain_core.tools import Tool
 from langchain.agents import create_agent  # Updated import
 from langgraph.checkpoint.memory import MemorySaver
@@ -12,13 +15,24 @@ sys.path.append(os.path.dirname(__file__))
 
 from patient import Patient
 from ctProtocolAdvisor import CTProtocolAdvisor
-from fastapi import FastAPI
+from auditLog import AuditLog
+from modelRouter import ModelRouter
+from fastapi import FastAPI, Query
 from patientData import PatientData
 
 # Load environment variables from .env file
 dotenv.load_dotenv()
 
-app = FastAPI(title="CT Protocol Advisor API")
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    yield
+    audit_log.close()
+
+
+app = FastAPI(title="CT Protocol Advisor API", lifespan=lifespan)
 
 
 # Initialize the advisor (singleton instance)
@@ -27,6 +41,41 @@ advisor_instance = CTProtocolAdvisor()
 # Global variable to store the current patient object
 current_patient: Optional[Patient] = None
 
+# Picks the model tier for each case from deterministic complexity signals
+model_router = ModelRouter.from_env(advisor_instance)
+
+# Audit trail of every recommendation, written to disk by a background thread
+audit_log = AuditLog.from_env()
+
+
+def build_patient(patient_data: PatientData) -> Patient:
+    allergies = [a.strip() for a in (patient_data.allergies_str or '').split(',') if a.strip()]
+    return Patient(
+        patient_data.age, patient_data.sex, patient_data.weight,
+        patient_data.indication, patient_data.creatinine, allergies
+    )
+
+
+def build_audit_entry(patient_data: PatientData, patient: Patient, routing: Dict[str, Any]) -> Dict[str, Any]:
+    """Collects the deterministic part of a recommendation (matched protocols,
+    safety verdicts and computed doses) for the audit trail, reusing what the
+    router already computed so the record matches the routing decision."""
+    doses = {}
+    for protocol_name in routing["matched_protocols"]:
+        protocol = advisor_instance.get_protocol_details(protocol_name)
+        if protocol:
+            doses[protocol_name] = advisor_instance.calculate_contrast_dose(
+                protocol.get('contrast', 'None'), patient.weight
+            )
+
+    return {
+        "input": patient_data.model_dump(),
+        "matched_protocols": routing["matched_protocols"],
+        "safety": routing["safety"],
+        "doses": doses,
+        "routing": {k: v for k, v in routing.items() if k not in ("matched_protocols", "safety")},
+    }
+
 
 # --- LangChain Tools ---
 def get_patient_info(patient_info: str) -> str:
@@ -88,12 +137,15 @@ def get_protocol_details_tool(protocol_name: str, patient_weight: Optional[float
     if not protocol:
         return f"Protocol '{protocol_name}' not found."
 
-    details = [f"Protocol Name: {protocol_name.upper()}"]
-    details.append(f"Indications: {', '.join(protocol.get('indications', []))}")
-
     contrast_info = protocol.get('contrast', 'None')
     if patient_weight is not None:
         contrast_info = advisor_instance.calculate_contrast_dose(contrast_info, patient_weight)
+    return format_protocol_details(protocol_name, protocol, contrast_info)
+
+
+def format_protocol_details(protocol_name: str, protocol: Dict[str, Any], contrast_info: str) -> str:
+    details = [f"Protocol Name: {protocol_name.upper()}"]
+    details.append(f"Indications: {', '.join(protocol.get('indications', []))}")
     details.append(f"Contrast: {contrast_info}")
 
     if protocol.get('phases'):
@@ -134,8 +186,9 @@ def check_protocol_safety(protocol_name: str) -> str:
 
 # --- LangGraph Agent Setup ---
 
-def setup_ct_advisor_agent():
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+def setup_ct_advisor_agent(llm: Optional[Any] = None, with_memory: bool = True) -> Any:
+    if llm is None:
+        llm = model_router.get_llm("routine")
 
     tools = [
         Tool(
@@ -160,38 +213,115 @@ def setup_ct_advisor_agent():
         ),
     ]
 
-    memory = MemorySaver()
+    memory = MemorySaver() if with_memory else None
     agent = create_agent(model=llm, tools=tools, checkpointer=memory)
     return agent
 
-@app.post("/analyze-patient")
-async def analyze_patient(patient_data: PatientData):
+
+# Agents are reused across requests. Each request is a one-off conversation,
+# so they are built without a checkpointer that would keep every thread alive.
+agents_by_tier: Dict[str, Any] = {}
+
+
+def get_agent_for_tier(tier: str) -> Any:
+    if tier not in agents_by_tier:
+        agents_by_tier[tier] = setup_ct_advisor_agent(model_router.get_llm(tier), with_memory=False)
+    return agents_by_tier[tier]
+
+
+def render_template_recommendation(audit_entry: Dict[str, Any]) -> str:
+    """Deterministic recommendation for routine cases: a single matched protocol
+    with no safety findings needs no LLM."""
+    protocol_name = audit_entry["matched_protocols"][0]
+    protocol = advisor_instance.get_protocol_details(protocol_name) or {}
+    return (
+        f"Recommended CT protocol: {protocol_name.upper()}\n"
+        f"{format_protocol_details(protocol_name, protocol, audit_entry['doses'][protocol_name])}\n"
+        f"Safety Check: Protocol '{protocol_name.upper()}' is SAFE for this patient."
+    )
+
+def recommend(patient_data: PatientData) -> Dict[str, Any]:
+    """Routes a case to its model tier, runs it and records the outcome in the
+    router statistics and the audit trail. Shared by the API and the CLI."""
+    audit_entry: Optional[Dict[str, Any]] = None
     try:
-        agent_executor = setup_ct_advisor_agent()
-        
+        patient = build_patient(patient_data)
+        routing = model_router.assess(patient)
+        audit_entry = build_audit_entry(patient_data, patient, routing)
+        tier = routing["tier"]
+        thread_id = str(uuid.uuid4())
+        started = time.perf_counter()
+
+        if tier == "template":
+            recommendation = render_template_recommendation(audit_entry)
+            model_router.record(tier, time.perf_counter() - started)
+            audit_log.record({**audit_entry, "status": "success", "recommendation": recommendation},
+                             block=False)
+            return {
+                "status": "success",
+                "tier": tier,
+                "recommendation": recommendation
+            }
+
+        agent_executor = get_agent_for_tier(tier)
+
         query = (
             f"Patient age {patient_data.age}, sex {patient_data.sex}, weight {patient_data.weight}kg, "
             f"indication '{patient_data.indication}', creatinine {patient_data.creatinine}, "
             f"allergies '{patient_data.allergies_str}'. "
             f"What is the recommended CT protocol and its safety status?"
         )
-        
 
-        thread_id = str(uuid.uuid4())
         config = {"configurable": {"thread_id": thread_id}}
-            
-        result = agent_executor.invoke({"messages": [("user", query)]}, config=config)
+
+        try:
+            result = agent_executor.invoke({"messages": [("user", query)]}, config=config)
+        except Exception:
+            model_router.record(tier, time.perf_counter() - started, error=True)
+            raise
+        model_router.record(tier, time.perf_counter() - started, result["messages"])
+        recommendation = result["messages"][-1].content
+
+        audit_log.record({**audit_entry, "thread_id": thread_id,
+                          "status": "success", "recommendation": recommendation}, block=False)
 
         return {
             "status": "success",
-            "recommendation": result["messages"][-1].content
+            "tier": tier,
+            "recommendation": recommendation
         }
     except Exception as e:
+        try:
+            if audit_entry is None:
+                audit_entry = {"input": patient_data.model_dump(), "matched_protocols": []}
+            audit_log.record({**audit_entry, "status": "error", "message": str(e)}, block=False)
+        except Exception:
+            logger.exception("Failed to record audit entry")
         return {
             "status": "error",
             "message": str(e)
         }
 
+@app.post("/analyze-patient")
+async def analyze_patient(patient_data: PatientData) -> Dict[str, Any]:
+    return recommend(patient_data)
+
+@app.get("/audit")
+def query_audit(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                protocol: Optional[str] = None, limit: int = Query(100, ge=1, le=1000)) -> Dict[str, Any]:
+    """Returns audited recommendations filtered by date range and protocol.
+    Plain def so the blocking SQLite/gzip reads run in FastAPI's threadpool."""
+    return {
+        "stats": audit_log.stats(),
+        "entries": audit_log.query(start=start, end=end, protocol=protocol, limit=limit)
+    }
+
+@app.get("/model-stats")
+async def model_stats() -> Dict[str, Dict[str, Any]]:
+    """Returns per-tier latency and cost statistics of the model router."""
+    stats: Dict[str, Dict[str, Any]] = model_router.stats()
+    return stats
+
 @app.get("/")
 async def root():
     return {"message": "CT Protocol Advisor API"}
@@ -199,9 +329,7 @@ async def root():
 
 # --- Main CLI Loop ---
 
-def run_agent_interaction():
-    agent_executor = setup_ct_advisor_agent()
-
+def run_agent_interaction() -> None:
     print("\n=== AI CT PROTOCOL ADVISOR ===")
     print("Please provide patient details (type 'exit' to quit).")
 
@@ -224,22 +352,20 @@ def run_agent_interaction():
             allergies_input = input("Known severe allergy to iodine contrast? (y/n): ").lower()
             allergies_str = "iodine" if allergies_input == 'y' else ""
 
-            query = (
-                f"Patient age {age}, sex {sex}, weight {weight}kg, "
-                f"indication '{indication}', creatinine {creatinine}, allergies '{allergies_str}'. "
-                f"What is the recommended CT protocol and its safety status?"
+            patient_data = PatientData(
+                age=age, sex=sex, weight=weight, indication=indication,
+                creatinine=creatinine, allergies_str=allergies_str
             )
 
             print("\nThinking...\n")
- 
-            thread_id = str(uuid.uuid4())
-            config = {"configurable": {"thread_id": thread_id}}
-            
-            result = agent_executor.invoke({"messages": [("user", query)]}, config=config)
+
+            result = recommend(patient_data)
+            if result["status"] != "success":
+                raise RuntimeError(result["message"])
 
             print("\n" + "=" * 70)
-            print("Final Agent Response:")
-            print(result["messages"][-1].content)
+            print(f"Final Agent Response ({result['tier']} tier):")
+            print(result["recommendation"])
             print("=" * 70 + "\n")
 
         except Exception as e:
@@ -249,6 +375,8 @@ def run_agent_interaction():
         if another != 'y':
             break
 
+    audit_log.close()
+
 
 if __name__ == "__main__":
     run_agent_interaction()
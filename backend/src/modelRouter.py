@@ -0,0 +1,204 @@
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple, TypedDict
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_openai import ChatOpenAI
+
+from ctProtocolAdvisor import CTProtocolAdvisor
+from patient import Patient
+
+
+# USD per 1M tokens (input, output) for known models; others report cost as
+# unknown unless a price is configured (MODEL_ROUTINE_PRICE / MODEL_COMPLEX_PRICE)
+MODEL_PRICES = {
+    "fake": (0.0, 0.0),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+}
+
+
+class TierStats(TypedDict):
+    calls: int
+    errors: int
+    total_latency: float
+    input_tokens: int
+    output_tokens: int
+    cost_usd: Optional[float]  # None when the tier's model has no known price
+
+
+class FakeToolChatModel(FakeListChatModel):
+    """Local stand-in for a chat model, cycling through canned responses.
+
+    The agent binds tools to its model, which the plain fake model refuses to do,
+    so tool binding is accepted and ignored here.
+    """
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "FakeToolChatModel":
+        return self
+
+
+class ModelRouter:
+    """Routes each case to a model tier based on deterministic complexity signals.
+
+    Tiers:
+        template - single unambiguous protocol with no safety findings; answered
+                   without any LLM call (only when templates are enabled)
+        routine  - cheap, fast model for the easy majority of cases
+        complex  - larger model for ambiguous, unmatched or contraindicated cases
+    """
+
+    TIERS = ("template", "routine", "complex")
+
+    def __init__(
+        self,
+        advisor: CTProtocolAdvisor,
+        routine_model: str = "gpt-4o-mini",
+        complex_model: str = "gpt-4o",
+        complex_threshold: int = 2,
+        use_templates: bool = False,
+        prices: Optional[Dict[str, Tuple[float, float]]] = None,
+    ):
+        self.advisor = advisor
+        self.models = {"routine": routine_model, "complex": complex_model}
+        self.complex_threshold = complex_threshold
+        self.use_templates = use_templates
+
+        # Per-tier (input, output) USD per 1M tokens; None means the cost is unknown
+        prices = prices or {}
+        self.prices: Dict[str, Optional[Tuple[float, float]]] = {"template": (0.0, 0.0)}
+        for tier, model_name in self.models.items():
+            self.prices[tier] = prices.get(tier, MODEL_PRICES.get(model_name))
+
+        self._llms: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, TierStats] = {
+            tier: TierStats(calls=0, errors=0, total_latency=0.0, input_tokens=0, output_tokens=0,
+                            cost_usd=0.0 if self.prices[tier] is not None else None)
+            for tier in self.TIERS
+        }
+
+    @classmethod
+    def from_env(cls, advisor: CTProtocolAdvisor) -> "ModelRouter":
+        """Builds a ModelRouter from the MODEL_* environment variables.
+        Prices are given as 'input,output' USD per 1M tokens, e.g. '0.15,0.60'."""
+        prices: Dict[str, Tuple[float, float]] = {}
+        for tier in ("routine", "complex"):
+            price = os.getenv(f"MODEL_{tier.upper()}_PRICE")
+            if price:
+                input_price, output_price = (float(p) for p in price.split(","))
+                prices[tier] = (input_price, output_price)
+
+        return cls(
+            advisor,
+            routine_model=os.getenv("MODEL_ROUTINE", "gpt-4o-mini"),
+            complex_model=os.getenv("MODEL_COMPLEX", "gpt-4o"),
+            complex_threshold=int(os.getenv("MODEL_COMPLEX_THRESHOLD", "2")),
+            use_templates=os.getenv("MODEL_USE_TEMPLATES", "false").lower() == "true",
+            prices=prices,
+        )
+
+    def assess(self, patient: Patient) -> Dict[str, Any]:
+        """Scores case complexity and picks a tier. Returns the signals used,
+        including the matched protocols and their safety results, so the
+        decision can be logged and audited without recomputing them."""
+        matches = self.advisor.match_protocol(patient.indication)
+
+        safety: Dict[str, Dict[str, Any]] = {}
+        contraindications = 0
+        warnings = 0
+        for protocol_name in matches:
+            is_safe, messages = self.advisor.check_safety(patient, protocol_name)
+            safety[protocol_name] = {"is_safe": is_safe, "messages": messages}
+            if not is_safe:
+                contraindications += 1
+            elif messages:
+                warnings += 1
+
+        indication_words = len(patient.indication.split())
+
+        score = 0
+        if not matches:
+            score += 2  # The model has to reason without a protocol to anchor on
+        elif len(matches) > 1:
+            score += len(matches) - 1  # Needs to choose between candidate protocols
+        if contraindications:
+            score += 2
+        elif warnings:
+            score += 1
+        if indication_words > 25:
+            score += 2
+        elif indication_words > 12:
+            score += 1
+
+        if score >= self.complex_threshold:
+            tier = "complex"
+        elif score == 0 and self.use_templates:
+            tier = "template"
+        else:
+            tier = "routine"
+
+        return {
+            "tier": tier,
+            "score": score,
+            "matched_protocols": matches,
+            "safety": safety,
+            "contraindications": contraindications,
+            "warnings": warnings,
+            "indication_words": indication_words,
+        }
+
+    def get_llm(self, tier: str) -> Any:
+        """Returns the (cached) chat model configured for a tier.
+        A model name of 'fake' gives a local model for tests."""
+        if tier not in self.models:
+            raise ValueError(f"Tier '{tier}' has no model. Expected one of {list(self.models)}.")
+
+        with self._lock:
+            if tier not in self._llms:
+                model_name = self.models[tier]
+                if model_name == "fake":
+                    self._llms[tier] = FakeToolChatModel(responses=[f"Fake {tier} recommendation."])
+                else:
+                    self._llms[tier] = ChatOpenAI(model=model_name, temperature=0)
+            return self._llms[tier]
+
+    def record(self, tier: str, latency: float, messages: Optional[List[Any]] = None, error: bool = False) -> None:
+        """Adds one call's latency and token usage to the tier's statistics.
+        Failed calls count towards latency and `errors`."""
+        input_tokens = 0
+        output_tokens = 0
+        for message in messages or []:
+            usage = getattr(message, "usage_metadata", None)
+            if usage:
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+
+        price = self.prices[tier]
+
+        with self._lock:
+            stats = self._stats[tier]
+            stats["calls"] += 1
+            stats["errors"] += int(error)
+            stats["total_latency"] += latency
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+            if price is not None and stats["cost_usd"] is not None:
+                stats["cost_usd"] += (input_tokens * price[0] + output_tokens * price[1]) / 1_000_000
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-tier call counts, average latency and accumulated cost."""
+        with self._lock:
+            result: Dict[str, Dict[str, Any]] = {}
+            for tier, stats in self._stats.items():
+                calls = stats["calls"]
+                cost = stats["cost_usd"]
+                result[tier] = {
+                    **stats,
+                    "model": self.models.get(tier, "template"),
+                    "avg_latency": stats["total_latency"] / calls if calls else 0.0,
+                    "avg_cost_usd": None if cost is None else (cost / calls if calls else 0.0),
+                }
+            return result
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The service modules import each other by bare name (see src/main.py)
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
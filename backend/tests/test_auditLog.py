@@ -0,0 +1,176 @@
+import os
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from auditLog import AuditLog
+
+
+BACKENDS = ["sqlite", "jsonl"]
+
+
+def make_log(tmp_path, backend, **kwargs):
+    options = {"capacity": 100, "batch_size": 10, "flush_interval": 60.0}
+    options.update(kwargs)
+    return AuditLog(str(tmp_path), backend=backend, **options)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_overflow_drops_oldest_entries(tmp_path, backend):
+    # The writer only wakes on a full batch, which never happens with capacity 5
+    audit = make_log(tmp_path, backend, capacity=5, batch_size=100, block_timeout=0)
+
+    accepted = [audit.record({"i": i}) for i in range(8)]
+    assert accepted == [True] * 5 + [False] * 3
+    assert audit.stats()["dropped"] == 3
+
+    audit.close()
+    assert sorted(e["i"] for e in audit.query(limit=100)) == [3, 4, 5, 6, 7]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_flush_writes_without_waiting_for_interval(tmp_path, backend):
+    audit = make_log(tmp_path, backend)
+    audit.record({"matched_protocols": ["pe_study"]})
+
+    started = time.perf_counter()
+    assert audit.flush(timeout=5)
+    assert time.perf_counter() - started < 1.0
+    assert audit.stats()["written"] == 1
+    assert len(audit.query()) == 1
+    audit.close()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_close_writes_everything_queued(tmp_path, backend):
+    audit = make_log(tmp_path, backend, batch_size=7)
+    for i in range(25):
+        audit.record({"i": i})
+    audit.close()
+
+    assert audit.stats()["written"] == 25
+    assert sorted(e["i"] for e in audit.query(limit=100)) == list(range(25))
+    with pytest.raises(RuntimeError):
+        audit.record({"i": 25})
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_rotates_segments_by_size(tmp_path, backend):
+    audit = make_log(tmp_path, backend, max_segment_bytes=1)
+    for i in range(3):
+        audit.record({"i": i})
+        audit.flush(timeout=5)
+    audit.close()
+
+    assert len(audit._segments()) == 3
+    assert sorted(e["i"] for e in audit.query()) == [0, 1, 2]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_query_filters_by_date_and_protocol(tmp_path, backend):
+    audit = make_log(tmp_path, backend)
+    audit.record({"timestamp": "2026-01-10T08:00:00+00:00", "matched_protocols": ["pe_study"]})
+    audit.record({"timestamp": "2026-02-10T08:00:00+00:00", "matched_protocols": ["renal_mass"]})
+    audit.record({"timestamp": "2026-03-10T08:00:00+00:00", "matched_protocols": ["pe_study", "chest_cc"]})
+    audit.close()
+
+    february = audit.query(start=datetime(2026, 2, 1), end=datetime(2026, 2, 28, tzinfo=timezone.utc))
+    assert [e["matched_protocols"] for e in february] == [["renal_mass"]]
+
+    pe = audit.query(protocol="pe_study")
+    assert [e["timestamp"][:10] for e in pe] == ["2026-03-10", "2026-01-10"]
+
+    assert audit.query(protocol="pe_study", start=datetime(2026, 2, 1)) == pe[:1]
+    assert audit.query(protocol="brain_death") == []
+    assert len(audit.query(limit=2)) == 2
+    with pytest.raises(ValueError):
+        audit.query(limit=0)
+
+
+def test_failed_jsonl_batch_is_retried_without_duplicates(tmp_path, monkeypatch):
+    import auditLog
+
+    real_open = auditLog.gzip.open
+    failures = []
+
+    class FailingWriter:
+        """Writes half of the batch, then fails like a full disk would."""
+
+        def __init__(self, path, mode, encoding=None):
+            self.f = real_open(path, mode, encoding=encoding)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self.f.close()
+
+        def write(self, data):
+            self.f.write(data[: len(data) // 2])
+            self.f.flush()
+            raise OSError("disk full")
+
+    def flaky_open(path, mode="rb", encoding=None):
+        if "a" in mode and not failures:
+            failures.append(path)
+            return FailingWriter(path, mode, encoding)
+        return real_open(path, mode, encoding=encoding)
+
+    monkeypatch.setattr(auditLog.gzip, "open", flaky_open)
+    audit = make_log(tmp_path, "jsonl", flush_interval=0.01)
+    for i in range(4):
+        audit.record({"i": i})
+    audit.close()
+
+    assert failures
+    assert sorted(e["i"] for e in audit.query()) == [0, 1, 2, 3]
+
+
+def test_record_without_blocking_drops_immediately(tmp_path):
+    audit = make_log(tmp_path, "sqlite", capacity=1, batch_size=100, block_timeout=5.0)
+    audit.record({"i": 0})
+
+    started = time.perf_counter()
+    assert not audit.record({"i": 1}, block=False)
+    assert time.perf_counter() - started < 1.0
+    assert audit.stats()["dropped"] == 1
+    audit.close()
+
+
+def test_jsonl_query_with_limit_skips_older_segments(tmp_path, monkeypatch):
+    import auditLog
+
+    audit = make_log(tmp_path, "jsonl", max_segment_bytes=1)
+    for i in range(5):
+        audit.record({"i": i})
+        audit.flush(timeout=5)
+    audit.close()
+    assert len(audit._segments()) == 5
+
+    opened = []
+    real_open = auditLog.gzip.open
+
+    def counting_open(path, *args, **kwargs):
+        opened.append(path)
+        return real_open(path, *args, **kwargs)
+
+    monkeypatch.setattr(auditLog.gzip, "open", counting_open)
+    assert [e["i"] for e in audit.query(limit=2)] == [4, 3]
+    assert opened == list(reversed(audit._segments()))[:2]
+
+
+def test_sqlite_rotation_counts_wal_size(tmp_path):
+    max_bytes = 64 * 1024
+    audit = make_log(tmp_path, "sqlite", max_segment_bytes=max_bytes)
+    for i in range(20):
+        audit.record({"i": i, "notes": "x" * 10_000})
+        audit.flush(timeout=5)
+    audit.close()
+
+    segments = audit._segments()
+    assert len(segments) > 1
+    # A segment may overshoot by the batch written after its last size check
+    for path in segments:
+        assert os.path.getsize(path) < max_bytes + 32 * 1024
+    assert sorted(e["i"] for e in audit.query(limit=100)) == list(range(20))
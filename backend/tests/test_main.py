@@ -0,0 +1,98 @@
+import importlib
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="module")
+def main(tmp_path_factory):
+    overrides = {
+        "AUDIT_DIR": str(tmp_path_factory.mktemp("audit")),
+        "MODEL_ROUTINE": "fake",
+        "MODEL_COMPLEX": "fake",
+        "MODEL_USE_TEMPLATES": "true",
+    }
+    saved = {key: os.environ.get(key) for key in overrides}
+    os.environ.update(overrides)
+    module = importlib.import_module("main")
+    yield module
+    module.audit_log.close()
+    for key, value in saved.items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+
+
+@pytest.fixture(scope="module")
+def client(main):
+    return TestClient(main.app)
+
+
+def analyze(client, indication, **overrides):
+    payload = {"age": 45, "sex": "M", "weight": 70, "indication": indication,
+               "creatinine": 1.0, "allergies_str": "none"}
+    payload.update(overrides)
+    return client.post("/analyze-patient", json=payload).json()
+
+
+def test_routine_case_uses_template(main, client):
+    response = analyze(client, "kidney stone")
+    assert response["status"] == "success"
+    assert response["tier"] == "template"
+    assert "Recommended CT protocol: UROLITHIASIS" in response["recommendation"]
+
+
+def test_hard_case_uses_cached_agent_without_checkpointer(main, client):
+    response = analyze(client, "headache")
+    assert (response["tier"], response["recommendation"]) == ("complex", "Fake complex recommendation.")
+    assert main.agents_by_tier["complex"].checkpointer is None
+
+    stats = client.get("/model-stats").json()
+    assert stats["complex"]["calls"] >= 1 and stats["complex"]["errors"] == 0
+
+
+def test_agent_failure_is_recorded_in_stats(main, client, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("model unavailable")
+
+    agent = main.get_agent_for_tier("complex")
+    monkeypatch.setattr(agent, "invoke", fail)
+    before = main.model_router.stats()["complex"]["errors"]
+
+    response = analyze(client, "headache")
+    assert response == {"status": "error", "message": "model unavailable"}
+    assert main.model_router.stats()["complex"]["errors"] == before + 1
+
+
+def test_audit_entry_matches_routing(main, client):
+    analyze(client, "pulmonary embolism", allergies_str="iodine")
+    main.audit_log.flush(timeout=5)
+
+    entries = client.get("/audit", params={"protocol": "pe_study"}).json()["entries"]
+    assert entries[0]["matched_protocols"] == ["pe_study"]
+    assert entries[0]["routing"]["tier"] == "complex"
+    assert not entries[0]["safety"]["pe_study"]["is_safe"]
+    assert entries[0]["doses"]["pe_study"] == "60-100mL flow 4mL/s"
+
+
+def test_audit_rejects_invalid_limit(client):
+    assert client.get("/audit", params={"limit": -5}).status_code == 422
+    assert client.get("/audit", params={"limit": 1001}).status_code == 422
+
+
+def test_cli_routes_cases_like_the_api(main, monkeypatch, capsys):
+    answers = iter(["45", "M", "70", "kidney stone", "1.0", "n", "y",
+                    "45", "M", "70", "headache", "", "n", "n"])
+    monkeypatch.setattr("builtins.input", lambda prompt="": next(answers))
+    # The CLI closes the audit log on exit; keep it open for the other tests
+    monkeypatch.setattr(main.audit_log, "close", lambda *args, **kwargs: None)
+
+    main.run_agent_interaction()
+
+    output = capsys.readouterr().out
+    assert "(template tier)" in output
+    assert "Recommended CT protocol: UROLITHIASIS" in output
+    assert "(complex tier)" in output
+    assert "Fake complex recommendation." in output
@@ -0,0 +1,104 @@
+import pytest
+from langchain.agents import create_agent
+from langchain_core.messages import AIMessage
+
+from ctProtocolAdvisor import CTProtocolAdvisor
+from modelRouter import FakeToolChatModel, ModelRouter
+from patient import Patient
+
+
+@pytest.fixture
+def router():
+    return ModelRouter(CTProtocolAdvisor(), routine_model="fake", complex_model="fake")
+
+
+def make_patient(indication, weight=70.0, allergies=None):
+    return Patient(45, "M", weight, indication, 1.0, allergies)
+
+
+def test_single_match_without_findings_is_routine(router):
+    routing = router.assess(make_patient("kidney stone"))
+    assert routing["tier"] == "routine"
+    assert routing["score"] == 0
+    assert routing["matched_protocols"] == ["urolithiasis"]
+    assert routing["safety"]["urolithiasis"]["is_safe"]
+
+
+def test_templates_only_used_at_score_zero(router):
+    router.use_templates = True
+    assert router.assess(make_patient("kidney stone"))["tier"] == "template"
+    # Weight above the table limit is a warning, which needs a model
+    routing = router.assess(make_patient("kidney stone", weight=160))
+    assert (routing["tier"], routing["warnings"], routing["score"]) == ("routine", 1, 1)
+
+
+def test_no_match_is_complex(router):
+    routing = router.assess(make_patient("headache"))
+    assert (routing["tier"], routing["score"], routing["matched_protocols"]) == ("complex", 2, [])
+
+
+def test_each_extra_match_adds_to_score(router):
+    routing = router.assess(make_patient("liver mass and pancreatic mass"))
+    assert sorted(routing["matched_protocols"]) == ["liver_triphasic", "pancreas_GI"]
+    assert (routing["tier"], routing["score"]) == ("routine", 1)
+
+
+def test_contraindication_is_complex(router):
+    routing = router.assess(make_patient("pulmonary embolism", allergies=["iodine"]))
+    assert routing["contraindications"] == 1
+    assert not routing["safety"]["pe_study"]["is_safe"]
+    assert (routing["tier"], routing["score"]) == ("complex", 2)
+
+
+@pytest.mark.parametrize("extra_words, score, tier", [(11, 1, "routine"), (24, 2, "complex")])
+def test_long_indication_adds_to_score(router, extra_words, score, tier):
+    indication = "kidney stone " + " ".join(["left"] * extra_words)
+    routing = router.assess(make_patient(indication))
+    assert (routing["score"], routing["tier"]) == (score, tier)
+
+
+def test_record_computes_cost_from_token_usage():
+    router = ModelRouter(CTProtocolAdvisor(), routine_model="gpt-4o-mini", complex_model="gpt-4o")
+    usage = {"input_tokens": 1_000_000, "output_tokens": 500_000, "total_tokens": 1_500_000}
+    router.record("routine", 0.5, [AIMessage(content="a", usage_metadata=usage), ("user", "ignored")])
+    router.record("routine", 1.5, error=True)
+
+    stats = router.stats()["routine"]
+    assert stats["calls"] == 2 and stats["errors"] == 1
+    assert stats["avg_latency"] == pytest.approx(1.0)
+    assert stats["cost_usd"] == pytest.approx(0.15 + 0.30)
+    assert stats["avg_cost_usd"] == pytest.approx(0.225)
+    assert router.stats()["complex"]["cost_usd"] == 0.0
+
+
+def test_unknown_model_price_is_reported_as_unknown():
+    router = ModelRouter(CTProtocolAdvisor(), routine_model="some-new-model", complex_model="other-model",
+                         prices={"complex": (1.0, 2.0)})
+    router.record("routine", 0.1, [AIMessage(content="a", usage_metadata={
+        "input_tokens": 10, "output_tokens": 10, "total_tokens": 20})])
+
+    stats = router.stats()
+    assert stats["routine"]["cost_usd"] is None
+    assert stats["routine"]["avg_cost_usd"] is None
+    assert stats["complex"]["cost_usd"] == 0.0
+
+
+def test_from_env_reads_prices(monkeypatch):
+    monkeypatch.setenv("MODEL_ROUTINE", "some-new-model")
+    monkeypatch.setenv("MODEL_ROUTINE_PRICE", "0.1,0.2")
+    router = ModelRouter.from_env(CTProtocolAdvisor())
+    assert router.prices["routine"] == (0.1, 0.2)
+
+
+def test_fake_model_runs_in_agent(router):
+    llm = router.get_llm("routine")
+    assert isinstance(llm, FakeToolChatModel)
+    assert router.get_llm("routine") is llm
+
+    def noop(text: str) -> str:
+        """Does nothing."""
+        return text
+
+    agent = create_agent(model=llm, tools=[noop])
+    result = agent.invoke({"messages": [("user", "kidney stone")]})
+    assert result["messages"][-1].content == "Fake routine recommendation."
@@ -12,13 +12,18 @@ if (!API_KEY) {
 
 const ai = new GoogleGenAI({ apiKey: API_KEY! });
 
+// Protocol suggestion is text-only and routine, so it defaults to the fast model;
+// only image-based diagnosis needs the larger one.
+const PROTOCOL_MODEL = process.env.GEMINI_PROTOCOL_MODEL || 'gemini-2.5-flash';
+const DIAGNOSIS_MODEL = process.env.GEMINI_DIAGNOSIS_MODEL || 'gemini-2.5-pro';
+
 const textToHtml = (text: string) => {
     return text.replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>')
                .replace(/\*(.*?)\*/g, '<em>$1</em>');
 }
 
 const suggestProtocol = async (data: PatientData): Promise<string> => {
-    const model = 'gemini-2.5-flash';
+    const model = PROTOCOL_MODEL;
     // Fix: Consolidate instructions into systemInstruction and provide only data in the prompt.
     const prompt = `
         Patient Data:
@@ -38,7 +43,7 @@ const suggestProtocol = async (data: PatientData): Promise<string> => {
 };
 
 const suggestDiagnosis = async (data: PatientData): Promise<string> => {
-    const model = 'gemini-2.5-pro';
+    const model = DIAGNOSIS_MODEL;
     // Fix: Remove redundant instructions from the text part as they are already in systemInstruction.
     const textPart = { text: `
         Patient Data: